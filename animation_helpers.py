@@ -0,0 +1,374 @@
+"""Render matplotlib animations frame by frame in a process pool.
+
+Frames are drawn on the Agg backend in worker processes and their raw RGBA
+pixels are piped, in order, into ffmpeg, which writes the .gif or .mp4. Only a
+window of frames is ever in flight, so memory stays bounded however long the
+animation is. Gifs use one palette, built from the first frame, for the whole
+animation, which keeps them small.
+
+Usage:
+    python animation_helpers.py                # time the gapminder animation
+    python animation_helpers.py --processes 4  # ...with a given pool size
+"""
+
+import argparse
+import functools
+import io
+import os
+import subprocess
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+import matplotlib.pyplot as plt
+import pandas as pd
+from matplotlib.animation import FFMpegWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+
+def _use_agg():
+    """Worker initialiser: make sure frames are drawn off-screen."""
+    matplotlib.use("Agg")
+
+
+def _render_frame(draw_frame, frame, dpi):
+    """Draw one frame and return its RGBA pixels as bytes plus (width, height).
+
+    The figure is drawn on its own Agg canvas, so this works under any
+    backend without switching the caller's (eg a notebook's inline backend).
+    """
+    fig = draw_frame(frame)
+    fig.set_dpi(dpi)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    width, height = canvas.get_width_height(physical=True)
+    pixels = bytes(canvas.buffer_rgba())
+    plt.close(fig)
+    return pixels, (width, height)
+
+
+def _raw_input_args(size, fps):
+    """ffmpeg arguments to read raw RGBA frames of the given size from stdin."""
+    width, height = size
+    return [
+        FFMpegWriter.bin_path(),
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgba",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "pipe:",
+    ]
+
+
+def _make_palette(pixels, size, palette_path):
+    """Have ffmpeg build a gif palette from one frame's pixels."""
+    result = subprocess.run(
+        _raw_input_args(size, 1) + ["-vf", "palettegen", str(palette_path)],
+        input=pixels,
+        check=False,
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode()}")
+
+
+def _ffmpeg_command(out_path, size, fps, palette_path=None):
+    """Build an ffmpeg command that reads raw RGBA frames from stdin."""
+    command = _raw_input_args(size, fps)
+    suffix = Path(out_path).suffix.lower()
+    if suffix == ".gif":
+        # One palette for every frame, without dithering, so unchanged areas
+        # stay identical between frames and the gif only stores what moved
+        command += [
+            "-i",
+            str(palette_path),
+            "-lavfi",
+            "[0:v][1:v]paletteuse=dither=none",
+        ]
+    elif suffix == ".mp4":
+        # libx264 needs even dimensions
+        command += [
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-vcodec",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+        ]
+    else:
+        raise ValueError(f"Unsupported animation format: {suffix}")
+    return command + [str(out_path)]
+
+
+def render_animation(
+    frames,
+    draw_frame,
+    out_path,
+    fps=5,
+    dpi=150,
+    hold_last=0,
+    processes=None,
+    window=None,
+):
+    """Render a sequence of frames into a .gif or .mp4 file.
+
+    Args:
+        frames: a sequence of picklable frame payloads, eg from group_frames().
+        draw_frame: a module-level function taking one payload and returning a figure.
+        out_path: where to save the animation; the suffix picks the format.
+        fps: frames per second of the output.
+        dpi: resolution the frames are drawn at.
+        hold_last: how many extra times to show the last frame.
+        processes: size of the process pool. 1 draws frames in this process.
+        window: maximum number of frames in flight. Defaults to twice the pool size.
+    """
+    if not FFMpegWriter.isAvailable():
+        raise RuntimeError("ffmpeg is needed to write animations but was not found.")
+    if len(frames) == 0:
+        raise ValueError("There are no frames to render.")
+    processes = processes or os.cpu_count() or 1
+    window = window or 2 * processes
+
+    if processes == 1:
+        rendered = (_render_frame(draw_frame, frame, dpi) for frame in frames)
+        return _write_frames(rendered, out_path, fps, hold_last)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_use_agg) as pool:
+        rendered = _render_in_order(pool, draw_frame, frames, dpi, window)
+        return _write_frames(rendered, out_path, fps, hold_last)
+
+
+def _render_in_order(pool, draw_frame, frames, dpi, window):
+    """Yield rendered frames in order, with at most `window` submitted to the pool
+    but not yet yielded."""
+    to_submit = iter(frames)
+    in_flight = deque()
+    for frame in to_submit:
+        in_flight.append(pool.submit(_render_frame, draw_frame, frame, dpi))
+        if len(in_flight) >= window:
+            break
+    while in_flight:
+        result = in_flight.popleft().result()
+        for frame in to_submit:
+            in_flight.append(pool.submit(_render_frame, draw_frame, frame, dpi))
+            break
+        yield result
+
+
+def _write_frames(rendered, out_path, fps, hold_last):
+    """Stream rendered frames into ffmpeg, starting it once the size is known."""
+    proc = None
+    size = None
+    pixels = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for pixels, frame_size in rendered:
+                if proc is None:
+                    size = frame_size
+                    palette_path = Path(tmp_dir) / "palette.png"
+                    if Path(out_path).suffix.lower() == ".gif":
+                        _make_palette(pixels, size, palette_path)
+                    proc = subprocess.Popen(
+                        _ffmpeg_command(out_path, size, fps, palette_path),
+                        stdin=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                    )
+                elif frame_size != size:
+                    raise ValueError(
+                        f"Frame size changed from {size} to {frame_size}; "
+                        "use a fixed figsize and avoid bbox_inches='tight'."
+                    )
+                try:
+                    proc.stdin.write(pixels)
+                except BrokenPipeError:
+                    # ffmpeg has exited early; its stderr says why
+                    break
+            try:
+                for _ in range(hold_last):
+                    proc.stdin.write(pixels)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed: {proc.stderr.read().decode()}")
+        finally:
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+    return Path(out_path)
+
+
+def group_frames(df, columns, time_col="Year"):
+    """Split a dataframe into one payload per time period, in time order.
+
+    The data are indexed by time_col and grouped once, so no frame has to
+    filter the full dataframe again. Each payload is a dict of numpy arrays,
+    which keeps what gets pickled to the worker processes small.
+    """
+    indexed = df.set_index(time_col).sort_index()
+    return [
+        {"time": period, **{col: group[col].to_numpy() for col in columns}}
+        for period, group in indexed.groupby(level=time_col, sort=True)
+    ]
+
+
+def add_gapminder_colours(gap_df):
+    """Copy of owid_gapminder.csv data with a colour for each continent."""
+    gap_df = gap_df.copy()
+    colour_mapping = dict(
+        zip(
+            gap_df["Continent"].unique(),
+            plt.rcParams["axes.prop_cycle"].by_key()["color"],
+        )
+    )
+    gap_df["colour"] = gap_df["Continent"].map(colour_mapping)
+    return gap_df
+
+
+def gapminder_frames(gap_df):
+    """Frame payloads for the gapminder animation from owid_gapminder.csv."""
+    gap_df = add_gapminder_colours(gap_df)
+    frames = group_frames(
+        gap_df, ["GDP per capita", "Life expectancy", "Population", "colour"]
+    )
+    y_max = gap_df["Life expectancy"].max() * 1.2
+    for frame in frames:
+        frame["y_max"] = y_max
+    return frames
+
+
+def draw_gapminder_frame(frame):
+    """Plots the gapminder data for a single year's payload"""
+    fig, ax = plt.subplots(figsize=(4, 3))
+    ax.scatter(
+        x=frame["GDP per capita"] / 1e3,
+        y=frame["Life expectancy"],
+        c=frame["colour"],
+        s=frame["Population"] / 1e6,
+        alpha=0.8,
+        edgecolor="k",
+    )
+    ax.set_xlim(0, 100)
+    ax.set_ylim(20, frame["y_max"])
+    ax.set_xlabel("GDP per capita (1000s 2011 USD)")
+    ax.set_ylabel("Life expectancy (years)")
+    ax.set_title(f"Gapminder: {frame['time']}")
+    fig.tight_layout()
+    return fig
+
+
+def gapminder_at_year(i, gap_df):
+    """Plots the gapminder data for a given step, as in vis-animation.ipynb"""
+    # Map steps into years
+    step_to_yr_map = dict(
+        zip(range(len(gap_df["Year"].unique())), gap_df["Year"].unique())
+    )
+    # Filtered version of data with only the relevant year
+    gdf_yr = gap_df[gap_df["Year"] == step_to_yr_map[i]]
+    fig, ax = plt.subplots(figsize=(4, 3), dpi=150)
+    ax.scatter(
+        x=gdf_yr["GDP per capita"] / 1e3,
+        y=gdf_yr["Life expectancy"],
+        c=gdf_yr["colour"],
+        s=gdf_yr["Population"] / 1e6,
+        alpha=0.8,
+        edgecolor="k",
+    )
+    ax.set_xlim(0, 100)
+    ax.set_ylim(20, gap_df["Life expectancy"].max() * 1.2)
+    ax.set_xlabel("GDP per capita (1000s 2011 USD)")
+    ax.set_ylabel("Life expectancy (years)")
+    ax.set_title(f"Gapminder: {step_to_yr_map[i]}")
+    fig.tight_layout()
+    return fig
+
+
+def notebook_gapminder_gif(gap_df, steps, out_path, dpi=150):
+    """The notebook's original approach, used as the baseline for timings.
+
+    Each frame filters the full dataframe, is drawn in this process and kept
+    in memory as a PNG image, and the gif is written once all frames exist
+    (which is what the gif package does). Frames are saved at the given dpi,
+    as some backends change a figure's dpi when it is laid out.
+    """
+    images = []
+    for i in steps:
+        fig = gapminder_at_year(i, gap_df)
+        fig.set_dpi(dpi)
+        buffer = io.BytesIO()
+        FigureCanvasAgg(fig).print_png(buffer)
+        plt.close(fig)
+        images.append(Image.open(buffer))
+    images[0].save(
+        out_path, save_all=True, append_images=images[1:], duration=200, loop=0
+    )
+    return Path(out_path)
+
+
+def time_gapminder_animation(processes=None, out_dir="scratch"):
+    """Time the gapminder gif at 1x and 10x frames, three ways.
+
+    The baseline is the notebook's original approach. It is compared with
+    grouping the data once and streaming frames to ffmpeg, drawn either in
+    this process or in a pool. The 10x runs repeat the real frames ten times
+    to mimic a longer animation.
+    """
+    gap_df = add_gapminder_colours(pd.read_csv(Path("data/owid_gapminder.csv")))
+    frames = gapminder_frames(gap_df)
+    steps = list(range(len(frames)))
+    processes = processes or os.cpu_count() or 1
+    out_dir = Path(out_dir)
+    for multiple in [1, 10]:
+        n_frames = len(frames) * multiple
+        runs = [
+            (
+                "notebook baseline",
+                functools.partial(
+                    notebook_gapminder_gif,
+                    gap_df,
+                    steps * multiple,
+                    out_dir / f"gapminder_{multiple}x_notebook.gif",
+                ),
+            )
+        ]
+        for n_proc in sorted({1, processes}):
+            runs.append(
+                (
+                    f"grouped, {n_proc} process(es)",
+                    functools.partial(
+                        render_animation,
+                        frames * multiple,
+                        draw_gapminder_frame,
+                        out_dir / f"gapminder_{multiple}x.gif",
+                        processes=n_proc,
+                    ),
+                )
+            )
+        for label, run in runs:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(
+                f"{multiple:>2}x ({n_frames:>4} frames), {label:<24}: "
+                f"{elapsed:6.1f}s ({n_frames / elapsed:5.1f} frames/s)"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time rendering of the gapminder animation"
+    )
+    parser.add_argument("--processes", type=int, default=None, help="Pool size")
+    args = parser.parse_args()
+    time_gapminder_animation(args.processes)
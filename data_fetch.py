@@ -0,0 +1,226 @@
+"""Fetch the remote inputs to data_set_prep.py concurrently.
+
+Sources are listed in data_sources.toml. Downloads share one bounded
+connection pool, with a further limit on connections per host, and are
+streamed to disk. Interrupted downloads are resumed with range requests,
+finished files are checked against their SHA-256 hash (where one is given),
+and zipped shapefiles are unpacked. Connection errors, server errors (5xx)
+and rate limiting (429) are retried with exponential backoff.
+
+Files that are already there are kept, unless they don't match a pinned hash
+or are zips that can't be opened, in which case they are fetched again.
+
+A partial download is only resumed if it can be validated: either the
+server's ETag or Last-Modified from the first request is sent back as
+If-Range, so a changed remote file is fetched again in full, or a pinned
+hash will catch a corrupt result. Otherwise the download starts over.
+
+Usage:
+    python data_fetch.py                  # fetch every source
+    python data_fetch.py flights          # fetch only the named sources
+"""
+
+import asyncio
+import hashlib
+import sys
+import zipfile
+from pathlib import Path
+from urllib.parse import urlparse
+
+import httpx
+import toml
+
+MANIFEST = Path("data_sources.toml")
+CHUNK_SIZE = 1 << 16
+BACKOFF_SECONDS = 1  # doubled after each failed attempt
+
+
+def load_manifest(manifest_path=MANIFEST):
+    """Read the settings and list of sources from the manifest."""
+    manifest = toml.load(manifest_path)
+    return manifest.get("settings", {}), manifest.get("source", [])
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_zip(zip_path, extract_to):
+    Path(extract_to).mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(zip_path) as zf:
+        zf.extractall(extract_to)
+
+
+def is_extracted(zip_path, extract_to):
+    """Whether every member of the zip file is already in extract_to."""
+    with zipfile.ZipFile(zip_path) as zf:
+        return all((Path(extract_to) / name).exists() for name in zf.namelist())
+
+
+def validator_path(part_path):
+    """Where the ETag or Last-Modified of a partial download is kept."""
+    return part_path.with_name(part_path.name + ".validator")
+
+
+async def _stream_to_part_file(client, url, part_path, hash_pinned=False):
+    """Download url into part_path, resuming from however much is already there."""
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    validator_file = validator_path(part_path)
+    validator = validator_file.read_text() if validator_file.exists() else None
+    if offset and not (validator or hash_pinned):
+        # Nothing to tell whether the remote file has changed since, so start over
+        offset = 0
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    async with client.stream("GET", url, headers=headers) as response:
+        if offset and response.status_code == 416:
+            # Range starts at the end of the file: nothing left to fetch
+            return
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            # Server ignored the range request, or the remote file changed,
+            # so start again from scratch
+            offset = 0
+        if not offset:
+            new_validator = response.headers.get("ETag") or response.headers.get(
+                "Last-Modified"
+            )
+            if new_validator:
+                validator_file.write_text(new_validator)
+            else:
+                validator_file.unlink(missing_ok=True)
+        with open(part_path, "ab" if offset else "wb") as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                f.write(chunk)
+
+
+def is_retryable(error):
+    """Whether a failed request is worth trying again."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def fetch_source(client, source, host_limits, retries=3):
+    """Download, verify and (if needed) unpack a single source."""
+    path = Path(source["path"])
+    expected = source.get("sha256")
+    if (
+        path.exists()
+        and expected
+        and await asyncio.to_thread(file_sha256, path) != expected
+    ):
+        print(f"{source['name']}: {path} does not match its hash, fetching again")
+        path.unlink()
+    downloaded = not path.exists()
+    if downloaded:
+        await _download(client, source, path, host_limits, retries)
+    else:
+        print(f"{source['name']}: already at {path}")
+
+    extract_to = source.get("extract_to")
+    if not extract_to:
+        return path
+    try:
+        await _extract(source, path, extract_to)
+    except zipfile.BadZipFile:
+        if downloaded:
+            raise
+        print(f"{source['name']}: {path} is not a valid zip, fetching again")
+        path.unlink()
+        await _download(client, source, path, host_limits, retries)
+        await _extract(source, path, extract_to)
+    return path
+
+
+async def _extract(source, path, extract_to):
+    """Unpack a zipped source, unless every file in it is already there."""
+    # Checked even if the download already existed, in case unpacking failed before
+    if not await asyncio.to_thread(is_extracted, path, extract_to):
+        await asyncio.to_thread(extract_zip, path, extract_to)
+        print(f"{source['name']}: extracted to {extract_to}")
+
+
+async def _download(client, source, path, host_limits, retries):
+    """Stream a source to a .part file, verify it, then move it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = path.with_name(path.name + ".part")
+    expected = source.get("sha256")
+
+    async with host_limits[urlparse(source["url"]).netloc]:
+        for attempt in range(1, retries + 1):
+            try:
+                await _stream_to_part_file(
+                    client, source["url"], part_path, hash_pinned=bool(expected)
+                )
+                break
+            except httpx.HTTPError as e:
+                if attempt == retries or not is_retryable(e):
+                    raise
+                print(f"{source['name']}: {e!r}, retrying ({attempt}/{retries})")
+                await asyncio.sleep(BACKOFF_SECONDS * 2**attempt)
+
+    sha256 = await asyncio.to_thread(file_sha256, part_path)
+    validator_path(part_path).unlink(missing_ok=True)
+    if expected and sha256 != expected:
+        part_path.unlink()
+        raise ValueError(
+            f"{source['name']}: checksum mismatch, expected {expected} but got {sha256}"
+        )
+    part_path.replace(path)
+    print(f"{source['name']}: saved to {path} (sha256 {sha256})")
+
+
+async def fetch_all(sources, settings):
+    """Fetch sources concurrently. Raises once all have finished if any failed."""
+    max_per_host = settings.get("max_per_host", 2)
+    host_limits = {
+        urlparse(source["url"]).netloc: asyncio.Semaphore(max_per_host)
+        for source in sources
+    }
+    limits = httpx.Limits(max_connections=settings.get("max_connections", 8))
+    async with httpx.AsyncClient(
+        limits=limits,
+        timeout=settings.get("timeout_seconds", 60),
+        follow_redirects=True,
+    ) as client:
+        results = await asyncio.gather(
+            *(
+                fetch_source(client, source, host_limits, settings.get("retries", 3))
+                for source in sources
+            ),
+            return_exceptions=True,
+        )
+    failures = {
+        source["name"]: result
+        for source, result in zip(sources, results)
+        if isinstance(result, Exception)
+    }
+    for name, error in failures.items():
+        print(f"{name}: failed with {error!r}", file=sys.stderr)
+    if failures:
+        raise RuntimeError(f"Could not fetch: {', '.join(failures)}")
+    return results
+
+
+def fetch_sources(names=None, manifest_path=MANIFEST):
+    """Fetch the named sources from the manifest, or all of them."""
+    settings, sources = load_manifest(manifest_path)
+    if names:
+        unknown = set(names) - {source["name"] for source in sources}
+        if unknown:
+            raise ValueError(f"Unknown sources: {', '.join(sorted(unknown))}")
+        sources = [source for source in sources if source["name"] in names]
+    return asyncio.run(fetch_all(sources, settings))
+
+
+if __name__ == "__main__":
+    fetch_sources(sys.argv[1:])
@@ -0,0 +1,275 @@
+"""Per-step timing and memory telemetry for the functions in data_set_prep.py.
+
+Decorate a prep function with @instrument and wrap its steps in stage() to
+record, for each step, the wall time, resident memory (RSS), and the bytes and
+rows going in and out. Records are emitted through loguru as one JSON object
+per line; start_run() sends them to a file per run. They are kept out of
+loguru's default stderr handler, so the normal output of a script stays
+readable.
+
+Memory is measured per stage by sampling the process's RSS with psutil in a
+background thread while the stage runs:
+
+- rss_start_bytes: RSS when the stage starts
+- peak_rss_bytes: highest RSS seen during the stage
+- peak_rss_growth_bytes: peak_rss_bytes minus rss_start_bytes, ie how much
+  memory the stage itself needed on top of what was already held. This is the
+  memory figure compared between runs, as it does not depend on what ran before.
+
+Very short-lived allocations between samples can be missed.
+
+Usage (in code):
+    @instrument
+    def prep_something():
+        with stage("read", source=path) as st:
+            df = pd.read_csv(path)
+            st.result = df
+
+Usage (comparing two runs):
+    python prep_telemetry.py scratch/telemetry/base.jsonl scratch/telemetry/new.jsonl
+    python prep_telemetry.py base.jsonl new.jsonl --threshold 0.1 --min-seconds 1
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import psutil
+from loguru import logger
+
+TELEMETRY_DIR = Path("scratch/telemetry")
+# Metrics compared between runs; a rise beyond the threshold is a regression
+COMPARED_METRICS = ["wall_seconds", "peak_rss_growth_bytes"]
+RSS_SAMPLE_SECONDS = 0.01
+
+_current_function = ContextVar("current_function", default=None)
+_run_id = None
+_run_sink = None
+
+
+def is_telemetry(record):
+    return record["extra"].get("telemetry", False)
+
+
+# Swap loguru's default handler for one that skips telemetry records, unless
+# whoever imported this has already set up their own handlers
+try:
+    logger.remove(0)
+except ValueError:
+    pass
+else:
+    logger.add(sys.stderr, filter=lambda record: not is_telemetry(record))
+
+
+class RssSampler:
+    """Tracks the highest RSS of this process between start() and stop()."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        return self._process.memory_info().rss
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def start(self):
+        self.start_rss = self.peak = self._rss()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+        return self
+
+
+def size_in_bytes(obj):
+    """Size of a file on disk, or of a dataframe in memory."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (str, os.PathLike)):
+        path = Path(obj).expanduser()
+        if path.is_dir():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        return path.stat().st_size if path.exists() else None
+    return None
+
+
+def row_count(obj):
+    return len(obj) if isinstance(obj, (pd.DataFrame, pd.Series)) else None
+
+
+def emit(record):
+    logger.bind(telemetry=True).info(json.dumps(record, default=str))
+
+
+def start_run(run_id=None, directory=TELEMETRY_DIR):
+    """Send telemetry from this process to <directory>/<run_id>.jsonl."""
+    global _run_id, _run_sink
+    stop_run()
+    _run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{_run_id}.jsonl"
+    _run_sink = logger.add(path, format="{message}", filter=is_telemetry)
+    return path
+
+
+def stop_run():
+    """Stop sending telemetry to the current run's file, if there is one."""
+    global _run_id, _run_sink
+    if _run_sink is not None:
+        logger.remove(_run_sink)
+    _run_id = _run_sink = None
+
+
+class stage:
+    """Context manager that records one step of a prep function.
+
+    Set `source` to what the step reads (a path or dataframe) and, inside the
+    block, `result` to what it produces.
+    """
+
+    def __init__(self, name, source=None):
+        self.name = name
+        self.source = source
+        self.result = None
+
+    def __enter__(self):
+        self._rss = RssSampler().start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_seconds = time.perf_counter() - self._start
+        rss = self._rss.stop()
+        emit(
+            {
+                "run_id": _run_id,
+                "function": _current_function.get(),
+                "stage": self.name,
+                "wall_seconds": wall_seconds,
+                "rss_start_bytes": rss.start_rss,
+                "peak_rss_bytes": rss.peak,
+                "peak_rss_growth_bytes": rss.peak - rss.start_rss,
+                "input_bytes": size_in_bytes(self.source),
+                "output_bytes": size_in_bytes(self.result),
+                "input_rows": row_count(self.source),
+                "output_rows": row_count(self.result),
+                "failed": exc_type is not None,
+            }
+        )
+        return False
+
+
+def instrument(func):
+    """Record the whole call as a 'total' stage, and name the stages inside it."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_function.set(func.__name__)
+        try:
+            with stage("total"):
+                return func(*args, **kwargs)
+        finally:
+            _current_function.reset(token)
+
+    return wrapper
+
+
+def load_run(path):
+    """Read a run's JSONL into a dataframe indexed by function and stage."""
+    df = pd.read_json(path, lines=True)
+    # Keep the last record if a step ran more than once
+    return df.groupby(["function", "stage"])[COMPARED_METRICS].last()
+
+
+def compare_runs(base_path, new_path, threshold=0.2, min_seconds=0.5, min_mib=50):
+    """Relative change in each metric between two runs, with regressions flagged.
+
+    A metric only counts as a regression if it rose by more than `threshold`
+    as a fraction and also by more than a minimum amount (`min_seconds` of wall
+    time or `min_mib` MiB of memory), so that millisecond stages don't get
+    flagged on noise.
+    """
+    base = load_run(base_path)
+    new = load_run(new_path)
+    joined = base.join(new, lsuffix="_base", rsuffix="_new", how="inner")
+    min_increase = {
+        "wall_seconds": min_seconds,
+        "peak_rss_growth_bytes": min_mib * 2**20,
+    }
+    flags = []
+    for metric in COMPARED_METRICS:
+        increase = joined[f"{metric}_new"] - joined[f"{metric}_base"]
+        # Growth can be zero for tiny stages, so guard against dividing by it
+        joined[f"{metric}_change"] = increase / joined[f"{metric}_base"].where(
+            joined[f"{metric}_base"] > 0
+        )
+        flags.append(
+            (increase > min_increase[metric])
+            & ~(joined[f"{metric}_change"] <= threshold)
+        )
+    joined["regression"] = pd.concat(flags, axis=1).any(axis=1)
+    return joined
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two telemetry runs and flag regressions"
+    )
+    parser.add_argument("base", help="JSONL telemetry of the baseline run")
+    parser.add_argument("new", help="JSONL telemetry of the run to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Flag rises bigger than this fraction (default: 0.2, ie 20%%)",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.5,
+        help="Ignore wall time rises smaller than this (default: 0.5)",
+    )
+    parser.add_argument(
+        "--min-mib",
+        type=float,
+        default=50,
+        help="Ignore memory growth rises smaller than this many MiB (default: 50)",
+    )
+    args = parser.parse_args()
+
+    comparison = compare_runs(
+        args.base, args.new, args.threshold, args.min_seconds, args.min_mib
+    )
+    changes = comparison.filter(like="_change").map(lambda x: f"{x:+.1%}")
+    changes["regression"] = comparison["regression"]
+    with pd.option_context("display.max_rows", None, "display.max_columns", None):
+        print(changes)
+    regressions = comparison[comparison["regression"]]
+    if regressions.empty:
+        print(f"\nNo regressions above {args.threshold:.0%}")
+        return
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:")
+    for function, stage_name in regressions.index:
+        print(f"  {function}: {stage_name}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Move heavy notebook outputs into a content-addressed asset store and back.
+
+Executed notebooks carry their figures as base64 inside the .ipynb JSON, so
+every script that loads or rewrites them pays for the image data. This moves
+each output payload above a size threshold into a file named by its SHA-256
+hash, leaving an empty payload plus a reference in the output's metadata.
+The reference also records the payload's layout (string or list of lines,
+base64 line wrapping, trailing newline), so restoring gives back exactly the
+original JSON. Identical figures in different notebooks are stored only once.
+
+Assets are written atomically, and checked against their hash on restore, so
+an interrupted run or a damaged store never puts wrong data into a notebook.
+
+Idempotent: externalising an externalised notebook, or restoring a restored
+one, is a no-op.
+
+Usage:
+    python scripts/notebook_assets.py externalise *.ipynb
+    python scripts/notebook_assets.py externalise --threshold 4096 vis-matplotlib.ipynb
+    python scripts/notebook_assets.py restore *.ipynb
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import mimetypes
+import sys
+import tempfile
+from pathlib import Path
+
+# Key in an output's metadata that maps mime types to stored assets and layouts
+REFERENCE_KEY = "asset_store"
+DEFAULT_STORE = Path("_notebook_assets")
+DEFAULT_THRESHOLD = 10_000  # bytes
+
+# Mime types whose payloads are base64-encoded binary in the notebook
+BINARY_MIME_PREFIXES = ("image/png", "image/jpeg", "image/gif", "application/pdf")
+
+
+def is_binary(mime: str) -> bool:
+    return mime.startswith(BINARY_MIME_PREFIXES)
+
+
+def payload_to_bytes(mime: str, value) -> bytes:
+    """Turn a notebook output payload into the bytes to be stored."""
+    text = "".join(value) if isinstance(value, list) else value
+    if is_binary(mime):
+        return base64.b64decode("".join(text.split()))
+    return text.encode("utf-8")
+
+
+def payload_layout(mime: str, value) -> dict:
+    """How a payload is laid out in the notebook JSON, beyond its content."""
+    text = "".join(value) if isinstance(value, list) else value
+    layout = {"as_list": isinstance(value, list)}
+    if is_binary(mime):
+        first_line = text.split("\n", 1)[0]
+        layout["wrap"] = len(first_line) if "\n" in text.rstrip("\n") else 0
+        layout["trailing_newline"] = text.endswith("\n")
+    return layout
+
+
+def bytes_to_payload(mime: str, data: bytes, layout: dict):
+    """Turn stored bytes back into a notebook output payload laid out as before."""
+    if is_binary(mime):
+        text = base64.b64encode(data).decode("ascii")
+        if layout["wrap"]:
+            width = layout["wrap"]
+            text = "\n".join(text[i : i + width] for i in range(0, len(text), width))
+        if layout["trailing_newline"]:
+            text += "\n"
+    else:
+        text = data.decode("utf-8")
+    return text.splitlines(keepends=True) if layout["as_list"] else text
+
+
+def asset_name(mime: str, data: bytes) -> str:
+    """Content-addressed file name, eg 3f2a...e1.png"""
+    extension = mimetypes.guess_extension(mime.split(";")[0]) or ".bin"
+    return hashlib.sha256(data).hexdigest() + extension
+
+
+def write_asset(asset_path: Path, data: bytes):
+    """Write an asset via a temporary file, so it's never seen half-written."""
+    with tempfile.NamedTemporaryFile(
+        dir=asset_path.parent, prefix=f".{asset_path.name}.", delete=False
+    ) as tmp:
+        try:
+            tmp.write(data)
+        except BaseException:
+            tmp.close()
+            Path(tmp.name).unlink()
+            raise
+    Path(tmp.name).replace(asset_path)
+
+
+def iter_outputs(nb: dict):
+    """Yield every output that carries a mime bundle."""
+    for cell in nb.get("cells", []):
+        for output in cell.get("outputs", []):
+            if "data" in output:
+                yield output
+
+
+def externalise_notebook(nb: dict, store: Path, threshold: int) -> int:
+    """Move large payloads out of a notebook. Returns the number moved."""
+    moved = 0
+    for output in iter_outputs(nb):
+        references = output.get("metadata", {}).get(REFERENCE_KEY, {})
+        for mime, value in output["data"].items():
+            # JSON mime bundles are dicts, not strings; leave them alone
+            if mime in references or not isinstance(value, (str, list)):
+                continue
+            data = payload_to_bytes(mime, value)
+            if len(data) < threshold:
+                continue
+            layout = payload_layout(mime, value)
+            # Leave unusually laid out payloads in place rather than change them
+            if bytes_to_payload(mime, data, layout) != value:
+                continue
+            name = asset_name(mime, data)
+            asset_path = store / name
+            if not asset_path.exists():
+                write_asset(asset_path, data)
+            output["data"][mime] = ""
+            references[mime] = {"asset": name, **layout}
+            moved += 1
+        if references:
+            output.setdefault("metadata", {})[REFERENCE_KEY] = references
+    return moved
+
+
+def restore_notebook(nb: dict, store: Path) -> int:
+    """Put stored payloads back into a notebook. Returns the number restored."""
+    restored = 0
+    for output in iter_outputs(nb):
+        references = output.get("metadata", {}).pop(REFERENCE_KEY, {})
+        for mime, reference in references.items():
+            layout = dict(reference)
+            name = layout.pop("asset")
+            asset_path = store / name
+            if not asset_path.exists():
+                raise FileNotFoundError(
+                    f"Asset {name} for {mime} output is missing from {store}"
+                )
+            data = asset_path.read_bytes()
+            if hashlib.sha256(data).hexdigest() != Path(name).stem:
+                raise ValueError(
+                    f"Asset {name} for {mime} output in {store} does not match its hash"
+                )
+            output["data"][mime] = bytes_to_payload(mime, data, layout)
+            restored += 1
+    return restored
+
+
+def process_file(path: Path, command: str, store: Path, threshold: int) -> int:
+    """Externalise or restore one notebook in place. Returns payloads changed."""
+    nb = json.loads(path.read_bytes())
+    if command == "externalise":
+        changed = externalise_notebook(nb, store, threshold)
+    else:
+        changed = restore_notebook(nb, store)
+    if changed:
+        # Write with the same formatting as Jupyter and jb_to_quarto.py
+        path.write_text(
+            json.dumps(nb, ensure_ascii=False, indent=1) + "\n", encoding="utf-8"
+        )
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move heavy notebook outputs to a content-addressed store and back"
+    )
+    parser.add_argument("command", choices=["externalise", "restore"])
+    parser.add_argument("files", nargs="+", help="Notebooks to process")
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=DEFAULT_STORE,
+        help=f"Directory holding the assets (default: {DEFAULT_STORE})",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=DEFAULT_THRESHOLD,
+        help=f"Move payloads of at least this many bytes (default: {DEFAULT_THRESHOLD})",
+    )
+    args = parser.parse_args()
+
+    args.store.mkdir(parents=True, exist_ok=True)
+    total_changed = 0
+    for filepath in args.files:
+        path = Path(filepath)
+        if not path.exists():
+            print(f"WARNING: {path} does not exist, skipping", file=sys.stderr)
+            continue
+        if path.suffix != ".ipynb":
+            print(f"Skipping unsupported file type: {path}", file=sys.stderr)
+            continue
+        changed = process_file(path, args.command, args.store, args.threshold)
+        if changed:
+            total_changed += changed
+            verb = "Externalised" if args.command == "externalise" else "Restored"
+            print(f"{verb} {changed} output(s): {path}")
+
+    print(f"\nTotal outputs {args.command}d: {total_changed}")
+
+
+if __name__ == "__main__":
+    main()
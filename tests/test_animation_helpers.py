@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+import pytest
+from matplotlib.animation import FFMpegWriter
+from PIL import Image
+
+from animation_helpers import _render_in_order, _use_agg, render_animation
+
+pytestmark = pytest.mark.skipif(
+    not FFMpegWriter.isAvailable(), reason="ffmpeg is not available"
+)
+
+N_FRAMES = 8
+
+
+def draw_frame(i):
+    """A plain grey square whose shade is the frame number. Early frames take
+    longest to draw, so a pool finishes them out of order."""
+    time.sleep(0.02 * (N_FRAMES - i))
+    shade = i / N_FRAMES
+    return plt.figure(figsize=(1, 1), facecolor=(shade, shade, shade))
+
+
+def draw_growing_frame(i):
+    return plt.figure(figsize=(1 + i, 1))
+
+
+class CountingPool:
+    """Wraps a pool to record how many submitted frames are not yet yielded."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.submitted = 0
+
+    def submit(self, *args):
+        self.submitted += 1
+        return self.pool.submit(*args)
+
+
+def test_frames_arrive_in_order_with_bounded_window():
+    window = 3
+    with ProcessPoolExecutor(max_workers=3, initializer=_use_agg) as pool:
+        counting = CountingPool(pool)
+        shades = []
+        for yielded, (pixels, _) in enumerate(
+            _render_in_order(counting, draw_frame, range(N_FRAMES), 10, window),
+            start=1,
+        ):
+            assert counting.submitted - yielded <= window
+            shades.append(pixels[0])
+    assert shades == sorted(shades)
+    assert len(set(shades)) == N_FRAMES
+
+
+def test_render_animation_writes_every_frame(tmp_path):
+    out_path = render_animation(
+        range(N_FRAMES), draw_frame, tmp_path / "anim.gif", dpi=10, processes=2
+    )
+    with Image.open(out_path) as gif:
+        assert gif.n_frames == N_FRAMES
+        shades = []
+        for n in range(N_FRAMES):
+            gif.seek(n)
+            shades.append(gif.convert("L").getpixel((5, 5)))
+    assert shades == sorted(shades)
+
+
+def test_frame_size_change_raises(tmp_path):
+    with pytest.raises(ValueError, match="Frame size changed"):
+        render_animation(
+            range(3), draw_growing_frame, tmp_path / "anim.gif", dpi=10, processes=2
+        )
@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import io
+import re
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import data_fetch
+from data_fetch import fetch_all, validator_path
+
+ETAG = '"v1"'
+DATA = bytes(range(256)) * 400
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `files` and understands Range and If-Range, like a real CDN.
+
+    The first requests get the error statuses in `failures`, one each.
+    """
+
+    files = {}
+    failures = []
+    etag = ETAG
+    ignore_range = False
+    delay = 0
+    requests = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append((self.path, dict(self.headers)))
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(cls.delay)
+            if cls.failures:
+                self.send_response(cls.failures.pop(0))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._respond(cls.files[self.path])
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def _respond(self, data):
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        use_range = match and not self.ignore_range and if_range in (None, self.etag)
+        if use_range:
+            offset = int(match.group(1))
+            if offset >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            body = data[offset:]
+        else:
+            self.send_response(200)
+            body = data
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    handler = type(
+        "Handler",
+        (RangeHandler,),
+        {
+            "files": {"/data.bin": DATA},
+            "failures": [],
+            "requests": [],
+            "lock": threading.Lock(),
+        },
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(data_fetch, "BACKOFF_SECONDS", 0)
+
+
+def fetch(sources, **settings):
+    return asyncio.run(fetch_all(sources, {"retries": 1, **settings}))
+
+
+def source_for(base_url, tmp_path, name="data", **extra):
+    return {
+        "name": name,
+        "url": f"{base_url}/data.bin",
+        "path": str(tmp_path / f"{name}.bin"),
+        **extra,
+    }
+
+
+def part_file(tmp_path, name="data", content=b"", validator=None):
+    part_path = tmp_path / f"{name}.bin.part"
+    part_path.write_bytes(content)
+    if validator:
+        validator_path(part_path).write_text(validator)
+    return part_path
+
+
+def test_fresh_download(server, tmp_path):
+    _, base_url = server
+    fetch([source_for(base_url, tmp_path)])
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+    assert not list(tmp_path.glob("*.part*"))
+
+
+def test_resume_partial_download(server, tmp_path):
+    handler, base_url = server
+    part_file(tmp_path, content=DATA[:1000], validator=ETAG)
+    fetch([source_for(base_url, tmp_path)])
+    headers = handler.requests[0][1]
+    assert headers["Range"] == "bytes=1000-"
+    assert headers["If-Range"] == ETAG
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    handler, base_url = server
+    handler.ignore_range = True
+    part_file(tmp_path, content=b"x" * 1000, validator=ETAG)
+    fetch([source_for(base_url, tmp_path)])
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_complete_part_file_gets_416(server, tmp_path):
+    handler, base_url = server
+    part_file(tmp_path, content=DATA, validator=ETAG)
+    fetch([source_for(base_url, tmp_path)])
+    assert handler.requests[0][1]["Range"] == f"bytes={len(DATA)}-"
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_changed_remote_file_is_fetched_in_full(server, tmp_path):
+    _, base_url = server
+    part_file(tmp_path, content=b"old" * 100, validator='"v0"')
+    fetch([source_for(base_url, tmp_path)])
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_no_resume_without_validator_or_hash(server, tmp_path):
+    handler, base_url = server
+    part_file(tmp_path, content=b"x" * 1000)
+    fetch([source_for(base_url, tmp_path)])
+    assert "Range" not in handler.requests[0][1]
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_resume_with_pinned_hash(server, tmp_path):
+    handler, base_url = server
+    part_file(tmp_path, content=DATA[:1000])
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    fetch([source_for(base_url, tmp_path, sha256=sha256)])
+    assert handler.requests[0][1]["Range"] == "bytes=1000-"
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_checksum_mismatch_deletes_part_file(server, tmp_path):
+    _, base_url = server
+    with pytest.raises(RuntimeError, match="data"):
+        fetch([source_for(base_url, tmp_path, sha256="0" * 64)])
+    assert not (tmp_path / "data.bin").exists()
+    assert not (tmp_path / "data.bin.part").exists()
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_server_errors_are_retried(server, tmp_path, status):
+    handler, base_url = server
+    handler.failures = [status, status]
+    fetch([source_for(base_url, tmp_path)], retries=3)
+    assert len(handler.requests) == 3
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    handler, base_url = server
+    handler.failures = [404]
+    with pytest.raises(RuntimeError, match="data"):
+        fetch([source_for(base_url, tmp_path)], retries=3)
+    assert len(handler.requests) == 1
+
+
+def test_existing_file_with_wrong_hash_is_fetched_again(server, tmp_path):
+    handler, base_url = server
+    (tmp_path / "data.bin").write_bytes(b"stale")
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    fetch([source_for(base_url, tmp_path, sha256=sha256)])
+    assert len(handler.requests) == 1
+    assert (tmp_path / "data.bin").read_bytes() == DATA
+    # A file that matches its hash is kept
+    fetch([source_for(base_url, tmp_path, sha256=sha256)])
+    assert len(handler.requests) == 1
+
+
+def zip_source(handler, base_url, tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("rivers.shp", b"shape")
+        zf.writestr("rivers.dbf", b"table")
+    handler.files["/rivers.zip"] = buffer.getvalue()
+    return {
+        "name": "rivers",
+        "url": f"{base_url}/rivers.zip",
+        "path": str(tmp_path / "rivers.zip"),
+        "extract_to": str(tmp_path / "rivers"),
+    }
+
+
+def test_corrupt_zip_is_fetched_again(server, tmp_path):
+    handler, base_url = server
+    source = zip_source(handler, base_url, tmp_path)
+    (tmp_path / "rivers.zip").write_bytes(b"truncated")
+    fetch([source])
+    assert len(handler.requests) == 1
+    assert (tmp_path / "rivers" / "rivers.shp").read_bytes() == b"shape"
+
+
+def test_zip_extraction_and_retry_after_failure(server, tmp_path):
+    handler, base_url = server
+    source = zip_source(handler, base_url, tmp_path)
+    extract_to = tmp_path / "rivers"
+    fetch([source])
+    assert (extract_to / "rivers.shp").read_bytes() == b"shape"
+    # Zip already downloaded but not unpacked, eg because extraction failed
+    (extract_to / "rivers.shp").unlink()
+    fetch([source])
+    assert (extract_to / "rivers.shp").read_bytes() == b"shape"
+    assert len(handler.requests) == 1
+
+
+@pytest.mark.parametrize("max_per_host", [1, 2])
+def test_per_host_limit(server, tmp_path, max_per_host):
+    handler, base_url = server
+    handler.delay = 0.2
+    sources = [source_for(base_url, tmp_path, name=f"data{i}") for i in range(4)]
+    fetch(sources, max_per_host=max_per_host)
+    assert handler.max_active == max_per_host
+    for i in range(4):
+        assert (tmp_path / f"data{i}.bin").read_bytes() == DATA
@@ -0,0 +1,94 @@
+import base64
+import copy
+import json
+
+import pytest
+
+from scripts.notebook_assets import (
+    REFERENCE_KEY,
+    asset_name,
+    externalise_notebook,
+    process_file,
+    restore_notebook,
+)
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40
+
+
+def png_payload(data=PNG, wrap=0, trailing_newline=False, as_list=False):
+    text = base64.b64encode(data).decode("ascii")
+    if wrap:
+        text = "\n".join(text[i : i + wrap] for i in range(0, len(text), wrap))
+    if trailing_newline:
+        text += "\n"
+    return text.splitlines(keepends=True) if as_list else text
+
+
+def notebook(*bundles):
+    return {
+        "cells": [
+            {
+                "cell_type": "code",
+                "metadata": {},
+                "source": [],
+                "outputs": [
+                    {"output_type": "display_data", "data": bundle, "metadata": {}}
+                    for bundle in bundles
+                ],
+            }
+        ],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+
+def write_notebook(path, nb):
+    path.write_text(json.dumps(nb, ensure_ascii=False, indent=1) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("as_list", [False, True])
+@pytest.mark.parametrize("wrap", [0, 76])
+@pytest.mark.parametrize("trailing_newline", [False, True])
+def test_round_trip_is_byte_identical(tmp_path, as_list, wrap, trailing_newline):
+    payload = png_payload(wrap=wrap, trailing_newline=trailing_newline, as_list=as_list)
+    path = write_notebook(tmp_path / "nb.ipynb", notebook({"image/png": payload}))
+    original = path.read_bytes()
+    store = tmp_path / "store"
+    store.mkdir()
+    assert process_file(path, "externalise", store, threshold=100) == 1
+    assert path.read_bytes() != original
+    assert process_file(path, "restore", store, threshold=100) == 1
+    assert path.read_bytes() == original
+
+
+def test_identical_images_are_stored_once(tmp_path):
+    nb = notebook({"image/png": png_payload()}, {"image/png": png_payload(wrap=76)})
+    assert externalise_notebook(nb, tmp_path, threshold=100) == 2
+    assert [p.name for p in tmp_path.iterdir()] == [asset_name("image/png", PNG)]
+
+
+def test_externalising_twice_is_a_no_op(tmp_path):
+    nb = notebook({"image/png": png_payload()})
+    externalise_notebook(nb, tmp_path, threshold=100)
+    once = copy.deepcopy(nb)
+    assert externalise_notebook(nb, tmp_path, threshold=100) == 0
+    assert nb == once
+
+
+def test_json_bundles_are_left_alone(tmp_path):
+    bundle = {"application/json": {"values": list(range(5000))}}
+    nb = notebook(bundle)
+    assert externalise_notebook(nb, tmp_path, threshold=100) == 0
+    assert nb == notebook(bundle)
+    assert not list(tmp_path.iterdir())
+
+
+def test_restore_checks_asset_hash(tmp_path):
+    nb = notebook({"image/png": png_payload()})
+    externalise_notebook(nb, tmp_path, threshold=100)
+    reference = nb["cells"][0]["outputs"][0]["metadata"][REFERENCE_KEY]["image/png"]
+    (tmp_path / reference["asset"]).write_bytes(b"damaged")
+    with pytest.raises(ValueError, match="does not match its hash"):
+        restore_notebook(nb, tmp_path)
@@ -0,0 +1,94 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from prep_telemetry import compare_runs, instrument, stage, start_run, stop_run
+
+MIB = 2**20
+
+
+@pytest.fixture
+def run_file(tmp_path):
+    """Telemetry of the test goes to a file, which is returned as parsed records."""
+    path = start_run("test", tmp_path)
+    yield lambda: [json.loads(line) for line in path.read_text().splitlines()]
+    stop_run()
+
+
+@instrument
+def prep_big():
+    with stage("allocate") as st:
+        st.result = pd.DataFrame({"x": np.ones(300 * MIB // 8)})
+    return st.result
+
+
+@instrument
+def prep_small():
+    with stage("allocate") as st:
+        st.result = pd.DataFrame({"x": [1]})
+
+
+def test_memory_is_measured_per_stage(run_file):
+    big = prep_big()
+    prep_small()
+    records = {
+        (r["function"], r["stage"]): r for r in run_file() if r["stage"] != "total"
+    }
+    assert records[("prep_big", "allocate")]["peak_rss_growth_bytes"] > 250 * MIB
+    # The big frame is still held, but the small stage didn't need more memory
+    assert records[("prep_small", "allocate")]["peak_rss_growth_bytes"] < 20 * MIB
+    assert records[("prep_small", "allocate")]["output_rows"] == 1
+    del big
+
+
+def test_telemetry_stays_out_of_stderr():
+    # In a fresh interpreter, as loguru's default handler is set up on import
+    script = (
+        "from loguru import logger\n"
+        "from prep_telemetry import emit\n"
+        "logger.info('normal output')\n"
+        "emit({'stage': 'telemetry record'})\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "normal output" in result.stderr
+    assert "telemetry record" not in result.stderr
+
+
+def write_run(path, wall_seconds, growth_mib):
+    record = {
+        "function": "prep_x",
+        "stage": "filter",
+        "wall_seconds": wall_seconds,
+        "peak_rss_growth_bytes": growth_mib * MIB,
+    }
+    path.write_text(json.dumps(record) + "\n")
+    return path
+
+
+@pytest.mark.parametrize(
+    "base, new, regression",
+    [
+        ((0.001, 1), (0.004, 3), False),  # big relative rises, tiny absolute ones
+        ((2.0, 100), (3.0, 100), True),  # slower by a second and 50%
+        ((2.0, 100), (2.2, 100), False),  # within the threshold
+        ((2.0, 100), (2.0, 200), True),  # needs 100 MiB more memory
+        ((2.0, 0), (2.0, 80), True),  # growth from nothing
+    ],
+)
+def test_compare_runs(tmp_path, base, new, regression):
+    comparison = compare_runs(
+        write_run(tmp_path / "base.jsonl", *base),
+        write_run(tmp_path / "new.jsonl", *new),
+    )
+    assert comparison.loc[("prep_x", "filter"), "regression"] == regression